@@ -7,24 +7,31 @@ Environment variables:
 - EXCLUDE_TAG_KEY (str) : tag key to check to exclude snapshot from deletion (default "Keep")
 - EXCLUDE_TAG_VALUE (str) : tag value which, if present with the key above, excludes snapshot (default "true")
 - LOG_LEVEL (str) : logging level (DEBUG, INFO, WARNING, ERROR) default INFO
+- AMI_INDEX_CACHE_TTL (int) : seconds to reuse the cached AMI snapshot index in /tmp; 0 disables (default: 3600)
 
 How it works:
-- Lists snapshots owned by the current account.
-- Filters snapshots by age (> RETENTION_DAYS) and state == 'completed'.
+- Lists 'completed' snapshots owned by the current account (status filtered server-side).
+- Filters snapshots by age (> RETENTION_DAYS).
 - Skips snapshots with the exclude tag key=value.
-- Skips snapshots referenced by AMIs.
+- Skips snapshots referenced by AMIs (index cached in /tmp across warm invocations).
 - If DRY_RUN is false, attempts to delete the snapshot.
 """
 
 import os
+import json
+import time
 import logging
 import boto3
+from collections import defaultdict
 from datetime import datetime, timezone, timedelta
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 # Create AWS clients outside handler for re-use / performance
-_ec2 = boto3.client("ec2")
-_account_id = None  # lazily resolved
+_boto_config = Config(retries={"mode": "adaptive", "max_attempts": 10}, tcp_keepalive=True)
+_ec2 = boto3.client("ec2", config=_boto_config)
+# STS is called during cold start: keep its retry budget small so a slow endpoint can't eat the init phase
+_sts = boto3.client("sts", config=Config(retries={"total_max_attempts": 2}, connect_timeout=2, read_timeout=2))
 
 # Env defaults
 def get_env_int(name, default):
@@ -40,100 +47,131 @@ RETENTION_DAYS = get_env_int("RETENTION_DAYS", 30)
 DRY_RUN = os.getenv("DRY_RUN", "true").lower() in ("1", "true", "yes", "y")
 EXCLUDE_TAG_KEY = os.getenv("EXCLUDE_TAG_KEY", "Keep")
 EXCLUDE_TAG_VALUE = os.getenv("EXCLUDE_TAG_VALUE", "true")
+_EXCLUDE_TAG_VALUE_LOWER = EXCLUDE_TAG_VALUE.lower()
+_EXCLUDE_TAG_REASON = f"excluded by tag {EXCLUDE_TAG_KEY}={EXCLUDE_TAG_VALUE}"
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+AMI_INDEX_CACHE_TTL = get_env_int("AMI_INDEX_CACHE_TTL", 3600)
+AMI_INDEX_CACHE_PATH = "/tmp/ami_snap_index.json"
 
 logging.basicConfig()
 logger = logging.getLogger("stale-ebs-snapshots")
 logger.setLevel(LOG_LEVEL)
 
-def get_account_id():
-    global _account_id
-    if _account_id:
-        return _account_id
+def _resolve_account_id():
     try:
         # STS get-caller-identity is reliable for account id
-        sts = boto3.client("sts")
-        _account_id = sts.get_caller_identity()["Account"]
-        return _account_id
+        return _sts.get_caller_identity()["Account"]
     except Exception as e:
         logger.warning("Failed to determine account id via STS: %s", e)
         return None
 
-def snapshot_has_exclude_tag(snapshot):
+# Resolved at cold start so warm invocations skip STS entirely
+_account_id = _resolve_account_id()
+
+def get_account_id():
+    global _account_id
+    if not _account_id:
+        # cold-start lookup failed; retry
+        _account_id = _resolve_account_id()
+    return _account_id
+
+def snapshot_has_exclude_tag(snapshot, _key=EXCLUDE_TAG_KEY, _value=_EXCLUDE_TAG_VALUE_LOWER):
     """Return True if snapshot has tag EXCLUDE_TAG_KEY=EXCLUDE_TAG_VALUE."""
-    tags = snapshot.get("Tags") or []
-    for t in tags:
-        if t.get("Key") == EXCLUDE_TAG_KEY:
-            # If no value specified and key exists, treat as excluded
-            if EXCLUDE_TAG_VALUE == "" or t.get("Value", "").lower() == EXCLUDE_TAG_VALUE.lower():
-                return True
-    return False
-
-def snapshot_used_by_any_ami(snapshot_id):
-    """Return True if any AMI references this snapshot_id in its block device mappings."""
-    try:
-        # Describe images owned by self and others? We only need to check images owned by this account (likely)
-        # Use Filters with 'block-device-mapping.snapshot-id' to find images referencing the snapshot
-        resp = _ec2.describe_images(
-            Owners=[get_account_id()] if get_account_id() else ["self"],
-            Filters=[{
-                "Name": "block-device-mapping.snapshot-id",
-                "Values": [snapshot_id]
-            }]
-        )
-        images = resp.get("Images", [])
-        if images:
-            logger.debug("Snapshot %s is referenced by AMI(s): %s", snapshot_id, [i.get("ImageId") for i in images])
-            return True
-        return False
-    except ClientError as e:
-        logger.warning("Failed to describe images for snapshot %s: %s", snapshot_id, e)
-        # safest choice: treat as in-use to avoid accidental deletion when we can't confirm
-        return True
-    except Exception as e:
-        logger.exception("Unexpected error checking AMI usage for snapshot %s: %s", snapshot_id, e)
-        return True
-
-def list_owned_snapshots():
-    """Paginated listing of snapshots owned by the current account."""
-    owner_id = get_account_id()
-    paginator = _ec2.get_paginator("describe_snapshots")
-    params = {}
-    if owner_id:
-        params["OwnerIds"] = [owner_id]
-    else:
-        params["OwnerIds"] = ["self"]
-    for page in paginator.paginate(**params):
-        for snap in page.get("Snapshots", []):
+    # Defaults bind the module constants as locals; if no value is configured, the key alone excludes
+    return any(t.get("Key") == _key and (not _value or t.get("Value", "").lower() == _value)
+               for t in (snapshot.get("Tags") or ()))
+
+def build_ami_snapshot_index(owner_id):
+    """Return the set of snapshot ids referenced by block device mappings of AMIs owned by owner_id.
+
+    Errors are propagated: if we can't tell which snapshots back an AMI, no snapshot is safe to delete.
+    """
+    paginator = _ec2.get_paginator("describe_images")
+    snap_ids = set()
+    for page in paginator.paginate(Owners=[owner_id]):
+        for img in page.get("Images", []):
+            for mapping in img.get("BlockDeviceMappings", []):
+                snap_id = mapping.get("Ebs", {}).get("SnapshotId")
+                if snap_id:
+                    snap_ids.add(snap_id)
+    return snap_ids
+
+def load_ami_snapshot_index(owner_id):
+    """
+    Return the AMI snapshot index, reusing the copy cached in /tmp if it is younger than AMI_INDEX_CACHE_TTL.
+    /tmp survives between warm invocations of the same Lambda container.
+    A stale entry is harmless: EC2 refuses to delete a snapshot backing a registered AMI.
+    """
+    if AMI_INDEX_CACHE_TTL > 0:
+        try:
+            if time.time() - os.path.getmtime(AMI_INDEX_CACHE_PATH) < AMI_INDEX_CACHE_TTL:
+                with open(AMI_INDEX_CACHE_PATH) as f:
+                    cached = json.load(f)
+                if cached.get("owner_id") == owner_id:
+                    logger.debug("Using cached AMI snapshot index from %s", AMI_INDEX_CACHE_PATH)
+                    return set(cached["snapshot_ids"])
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("Ignoring unreadable AMI index cache %s: %s", AMI_INDEX_CACHE_PATH, e)
+
+    snap_ids = build_ami_snapshot_index(owner_id)
+
+    if AMI_INDEX_CACHE_TTL > 0:
+        try:
+            tmp_path = AMI_INDEX_CACHE_PATH + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"owner_id": owner_id, "snapshot_ids": sorted(snap_ids)}, f)
+            os.replace(tmp_path, AMI_INDEX_CACHE_PATH)
+        except OSError as e:
+            logger.warning("Failed to write AMI index cache %s: %s", AMI_INDEX_CACHE_PATH, e)
+    return snap_ids
+
+def list_owned_snapshots(owner_id):
+    """Paginated listing of completed snapshots owned by owner_id (account id or "self")."""
+    # Let EC2 drop pending/error snapshots so they never cross the wire.
+    # The exclude tag can't be expressed as a negative filter, so it stays client-side.
+    params = {
+        "OwnerIds": [owner_id],
+        "Filters": [{"Name": "status", "Values": ["completed"]}],
+        "MaxResults": 1000,
+    }
+    # Manual NextToken loop: the boto3 paginator is markedly slower on describe_snapshots for large accounts
+    while True:
+        resp = _ec2.describe_snapshots(**params)
+        for snap in resp.get("Snapshots", []):
             yield snap
+        token = resp.get("NextToken")
+        if not token:
+            break
+        params["NextToken"] = token
 
-def should_delete_snapshot(snapshot, cutoff_dt):
+def should_delete_snapshot(snapshot, cutoff_ts, ami_snap_ids):
     """
     Return (True/False, reason str) whether snapshot should be deleted.
-    - Must be older than cutoff_dt
-    - Must be in 'completed' state
+    - Must be older than cutoff_ts (POSIX timestamp of build_cutoff())
     - Must not have exclude tag
-    - Must not be referenced by any AMI
+    - Must not be referenced by any AMI (ami_snap_ids, see build_ami_snapshot_index)
     """
     snap_id = snapshot["SnapshotId"]
     start_time = snapshot["StartTime"]
-    state = snapshot.get("State", "").lower()
 
-    if state != "completed":
-        return False, f"state={state}"
     if not isinstance(start_time, datetime):
         return False, "no start time"
+    # Most snapshots fail on age, so compare plain floats and build no new objects for aware datetimes
     if start_time.tzinfo is None:
-        # make timezone-aware (assume UTC)
-        start_time = start_time.replace(tzinfo=timezone.utc)
+        # naive times are assumed UTC
+        start_ts = start_time.replace(tzinfo=timezone.utc).timestamp()
+    else:
+        start_ts = start_time.timestamp()
 
-    if start_time > cutoff_dt:
-        return False, f"age less than retention ({start_time.isoformat()})"
+    if start_ts > cutoff_ts:
+        return False, "age less than retention"
 
     if snapshot_has_exclude_tag(snapshot):
-        return False, f"excluded by tag {EXCLUDE_TAG_KEY}={EXCLUDE_TAG_VALUE}"
+        return False, _EXCLUDE_TAG_REASON
 
-    if snapshot_used_by_any_ami(snap_id):
+    if snap_id in ami_snap_ids:
         return False, "referenced by AMI"
 
     return True, "eligible"
@@ -181,6 +219,14 @@ def handler(event, context):
 
     cutoff = build_cutoff(retention_days)
     logger.info("Deleting snapshots older than %s (UTC)", cutoff.isoformat())
+    cutoff_ts = cutoff.timestamp()
+
+    # Resolve the owner once; it is invariant for the whole run
+    owner_id = get_account_id() or "self"
+
+    # One DescribeImages pass up front (or none, if cached) instead of one call per snapshot
+    ami_snap_ids = load_ami_snapshot_index(owner_id)
+    logger.info("Found %d snapshot(s) referenced by AMIs", len(ami_snap_ids))
 
     stats = {
         "total_scanned": 0,
@@ -188,19 +234,20 @@ def handler(event, context):
         "deleted": 0,
         "skipped": 0,
         "errors": 0,
-        "skipped_reasons": {}
+        "skipped_reasons": defaultdict(int)
     }
+    debug_enabled = logger.isEnabledFor(logging.DEBUG)
 
-    for snap in list_owned_snapshots():
+    for snap in list_owned_snapshots(owner_id):
         stats["total_scanned"] += 1
         snap_id = snap.get("SnapshotId")
         try:
-            eligible, reason = should_delete_snapshot(snap, cutoff)
+            eligible, reason = should_delete_snapshot(snap, cutoff_ts, ami_snap_ids)
             if not eligible:
                 stats["skipped"] += 1
-                stats["skipped_reasons"].setdefault(reason, 0)
                 stats["skipped_reasons"][reason] += 1
-                logger.debug("Skip %s: %s", snap_id, reason)
+                if debug_enabled:
+                    logger.debug("Skip %s: %s", snap_id, reason)
                 continue
 
             stats["eligible"] += 1
@@ -227,6 +274,7 @@ def handler(event, context):
 
     logger.info("Completed. Scanned=%d Eligible=%d Deleted=%d Skipped=%d Errors=%d",
                 stats["total_scanned"], stats["eligible"], stats["deleted"], stats["skipped"], stats["errors"])
+    stats["skipped_reasons"] = dict(stats["skipped_reasons"])
     logger.debug("Skipped reasons: %s", stats["skipped_reasons"])
 
     # Return stats (useful for synchronous invocation)
@@ -235,7 +283,6 @@ def handler(event, context):
 
 # If run as script (for local testing), call handler with dry-run defaults.
 if __name__ == "__main__":
-    import json
     # Basic local run
     event = {"retention_days": RETENTION_DAYS, "dry_run": DRY_RUN}
     res = handler(event, None)
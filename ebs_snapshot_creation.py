@@ -1,28 +1,141 @@
 import boto3
 import datetime
+import json
+from botocore.exceptions import ClientError
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Replace the ARN with your SNS topic ARN
 SNS_TOPIC_ARN = 'arn:aws:sns:us-west-2:123456789012:MyEBSSnapshots'
 
-def create_snapshot_and_notify(volume_id):
-    ec2 = boto3.resource('ec2')
-    volume = ec2.Volume(volume_id)
+# Set to True if subscribers expect one message per snapshot instead of a single summary
+NOTIFY_PER_SNAPSHOT = False
 
-    snapshot = volume.create_snapshot(
-        Description=f'Snapshot of {volume_id} on {datetime.datetime.now()}'
+# SNS PublishBatch accepts at most 10 entries per request
+SNS_BATCH_SIZE = 10
+
+# Snapshot calls are network-bound, so a thread per volume is enough
+MAX_WORKERS = 16
+
+# Shared across worker threads and warm invocations (clients are thread-safe, resources are not)
+ec2_client = boto3.client('ec2')
+sns = boto3.client('sns')
+
+def create_volume_snapshot(volume_id, created_at):
+    snapshot_id = ec2_client.create_snapshot(
+        VolumeId=volume_id,
+        Description=f'Snapshot of {volume_id} on {created_at}'
+    )['SnapshotId']
+
+    return [{'snapshot_id': snapshot_id, 'volume_id': volume_id}]
+
+def create_instance_snapshots(instance_id, created_at):
+    """Snapshot every volume attached to instance_id with one CreateSnapshots call."""
+    result = ec2_client.create_snapshots(
+        InstanceSpecification={'InstanceId': instance_id, 'ExcludeBootVolume': False},
+        Description=f'Snapshot of {instance_id} on {created_at}'
     )
 
-    sns = boto3.client('sns')
-    response = sns.publish(
+    return [{'snapshot_id': s['SnapshotId'], 'volume_id': s['VolumeId']} for s in result['Snapshots']]
+
+def publish_snapshot_batch(chunk):
+    """Publish one message per snapshot in chunk (at most SNS_BATCH_SIZE) with a single PublishBatch call."""
+    response = sns.publish_batch(
         TopicArn=SNS_TOPIC_ARN,
-        Message=f'Snapshot {snapshot.id} created for volume {volume_id}',
-        Subject='EBS Snapshot Created'
+        PublishBatchRequestEntries=[
+            {
+                'Id': str(i),
+                'Subject': 'EBS Snapshot Created',
+                'Message': f"Snapshot {snap['snapshot_id']} created for volume {snap['volume_id']}"
+            }
+            for i, snap in enumerate(chunk)
+        ]
     )
-
+    for failed in response.get('Failed', []):
+        snap = chunk[int(failed['Id'])]
+        print(f"Failed to notify snapshot {snap['snapshot_id']}: {failed.get('Message')}")
     return response
 
+def notify(snapshots):
+    """Publish the snapshots created in this run: one summary message, or one message each if NOTIFY_PER_SNAPSHOT."""
+    if not NOTIFY_PER_SNAPSHOT:
+        return [sns.publish(
+            TopicArn=SNS_TOPIC_ARN,
+            Message=json.dumps({'snapshots': snapshots}),
+            Subject='EBS Snapshots Created'
+        )]
+
+    chunks = [snapshots[i:i + SNS_BATCH_SIZE] for i in range(0, len(snapshots), SNS_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(chunks))) as executor:
+        return list(executor.map(publish_snapshot_batch, chunks))
+
+def plan_snapshots(volume_ids):
+    """
+    Split volume_ids into (instance_ids, volume_ids).
+    An instance can use the batch CreateSnapshots call only when every volume attached to it was requested,
+    since that call always covers the whole instance; everything else is snapshotted per volume.
+    Planning is best-effort: if the volume lookup fails, every volume takes the per-volume path.
+    """
+    requested = set(volume_ids)
+    # A single volume can never be batched, so skip the extra DescribeVolumes round trip
+    if len(requested) < 2:
+        return [], list(volume_ids)
+
+    try:
+        by_instance = defaultdict(set)
+        for volume in ec2_client.describe_volumes(VolumeIds=list(requested))['Volumes']:
+            attachments = volume.get('Attachments', [])
+            # Multi-attach volumes are left to the per-volume path
+            if len(attachments) == 1:
+                by_instance[attachments[0]['InstanceId']].add(volume['VolumeId'])
+
+        # Only instances with 2+ requested volumes save calls by batching
+        candidates = [iid for iid, vols in by_instance.items() if len(vols) > 1]
+        if not candidates:
+            return [], list(volume_ids)
+
+        attached = defaultdict(set)
+        paginator = ec2_client.get_paginator('describe_volumes')
+        for page in paginator.paginate(Filters=[{'Name': 'attachment.instance-id', 'Values': candidates}]):
+            for volume in page['Volumes']:
+                for attachment in volume.get('Attachments', []):
+                    attached[attachment['InstanceId']].add(volume['VolumeId'])
+
+        instance_ids = [iid for iid in candidates if attached[iid] == by_instance[iid]]
+        batched = set().union(*(by_instance[iid] for iid in instance_ids))
+        return instance_ids, [v for v in volume_ids if v not in batched]
+    except ClientError as e:
+        # e.g. InvalidVolume.NotFound for one bad id: let the per-volume path attempt and report each volume
+        print(f'Could not plan batch snapshots, snapshotting per volume: {e}')
+        return [], list(volume_ids)
+
 def lambda_handler(event, context):
     VOLUME_IDS = event['volume_ids']
+    if not VOLUME_IDS:
+        return []
+
+    instance_ids, volume_ids = plan_snapshots(VOLUME_IDS)
+    # One timestamp for the whole run, so its snapshots share a description suffix
+    created_at = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+
+    snapshots = []
+    errors = {}
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(instance_ids) + len(volume_ids))) as executor:
+        futures = {executor.submit(create_instance_snapshots, i, created_at): i for i in instance_ids}
+        futures.update({executor.submit(create_volume_snapshot, v, created_at): v for v in volume_ids})
+        for future in as_completed(futures):
+            resource_id = futures[future]
+            try:
+                snapshots.extend(future.result())
+            except Exception as e:
+                print(f'Failed to snapshot {resource_id}: {e}')
+                errors[resource_id] = e
+
+    # Report whatever was created, even if some snapshots failed
+    if snapshots:
+        notify(snapshots)
+
+    if errors:
+        raise RuntimeError(f'Snapshot failed for: {", ".join(sorted(errors))}')
 
-    for volume_id in VOLUME_IDS:
-        create_snapshot_and_notify(volume_id)
+    return snapshots
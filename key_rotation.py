@@ -3,8 +3,13 @@
 # If the key has been active for 90 days, rotate it  and create a new one #
 # If the key has been active for 83 days, send a one-week email reminder.#
 # If the key has been active for 89 days, send a one-day email reminder. #
+# Not runnable as-is: send_email, delete_key, create_key and the email      #
+# subject/body constants must be supplied alongside this script.            #
   
+import csv
 import datetime
+import io
+import time
 from datetime import date
 import dateutil
 from dateutil import parser
@@ -13,33 +18,86 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 import boto3
 from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
 iam_client = boto3.client('iam')
-The following steps detail what the script does:
+# The following steps detail what the script does:
 
 
 ## Check the key age for each user with an active access key.
 
+# IAM calls are network-bound, so users are checked concurrently
+MAX_WORKERS = 20
+
+# Credential report polling: up to REPORT_MAX_POLLS checks, REPORT_POLL_SECONDS apart
+REPORT_MAX_POLLS = 30
+REPORT_POLL_SECONDS = 2
+
+def get_credential_report():
+    """Return the IAM credential report rows (one per user) as dicts.
+
+    Requires iam:GenerateCredentialReport and iam:GetCredentialReport.
+    """
+    # The report can be up to 4 hours old, so it is only a pre-filter; check_user re-checks live key data
+    # Report generation is asynchronous; poll until IAM has it ready
+    for _ in range(REPORT_MAX_POLLS):
+        if iam_client.generate_credential_report()['State'] == 'COMPLETE':
+            break
+        time.sleep(REPORT_POLL_SECONDS)
+    else:
+        raise RuntimeError("IAM credential report not ready after {} polls".format(REPORT_MAX_POLLS))
+    content = iam_client.get_credential_report()['Content']
+    return list(csv.DictReader(io.StringIO(content.decode('utf-8'))))
+
+def needs_attention(row):
+    """True if one of the user's active keys is due for a reminder or rotation."""
+    for n in ('1', '2'):
+        last_rotated = row['access_key_' + n + '_last_rotated']
+        if row['access_key_' + n + '_active'] != 'true' or last_rotated == 'N/A':
+            continue
+        active_for = date.today() - parser.isoparse(last_rotated).date()
+        if active_for.days >= 90 or active_for.days in (83, 89):
+            return True
+    return False
+
+def check_user(user):
+    """Rotate expired keys for one user; return the reminder emails that are due.
+
+    Errors are printed and yield no emails, so one bad user can't drop everyone else's reminders.
+    """
+    try:
+        emails = []
+        keys = iam_client.list_access_keys(UserName=user['UserName'])
+        for key in keys['AccessKeyMetadata']:
+            active_for = date.today() - key['CreateDate'].date()
+            # With active keys older than 90 days
+            if key['Status']=='Active' and active_for.days >= 90:
+                print (user['UserName'] + " - " + key['AccessKeyId'] + " - " + str(active_for.days) + " days old. Rotating.")
+                delete_key(key['AccessKeyId'], user['UserName'])
+                create_key(user['UserName'])
+            # Send a notification email 7 days before rotation
+            elif key['Status']=='Active' and active_for.days == 83:
+                emails.append((user['UserName'], subject_1_week, body_1_week, "in a week"))
+            # Send a notification email 1 day before rotation
+            elif key['Status']=='Active' and active_for.days == 89:
+                emails.append((user['UserName'], subject_1_day, body_1_day, "tomorrow"))
+        return emails
+    except Exception as e:
+        print("Failed to check access keys for " + user['UserName'] + ": " + str(e))
+        return []
+
 try:
-    marker = None
-    paginator = iam_client.get_paginator('list_users')
-    # Need to use a paginator because by default API call only returns 100 records
-    for page in paginator.paginate(PaginationConfig={'PageSize': 100, 'StartingToken': marker}):
-        print("Next Page : {} ".format(page['IsTruncated']))
-        u = page['Users']
-        for user in u:
-            keys = iam_client.list_access_keys(UserName=user['UserName'])
-            for key in keys['AccessKeyMetadata']:
-                active_for = date.today() - key['CreateDate'].date()
-                # With active keys older than 90 days
-                if key['Status']=='Active' and active_for.days >= 90:
-                    print (user['UserName'] + " - " + key['AccessKeyId'] + " - " + str(active_for.days) + " days old. Rotating.")
-                    delete_key(key['AccessKeyId'], user['UserName'])
-                    create_key(user['UserName'])
-                # Send a notification email 7 days before rotation
-                elif key['Status']=='Active' and active_for.days == 83:
-                    send_email("MAILBOX_EMAIL", "MAILBOX_PASSWORD", "recipient_email", subject_1_week, body_1_week)
-                    print ("Email sent to " + user['UserName'] + " warning of key rotation in a week.")
-                # Send a notification email 1 day before rotation
-                elif key['Status']=='Active' and active_for.days == 89:
-                    send_email("MAILBOX_EMAIL", "MAILBOX_PASSWORD", "recipient_email", subject_1_day, body_1_day)
-                    print ("Email sent to " + user['UserName'] + " warning of key rotation tomorrow.")
+    # One credential report covers every user's key ages, so list_access_keys
+    # is only needed for the few users that actually need action
+    flagged_users = [{'UserName': row['user']} for row in get_credential_report()
+                     if row['user'] != '<root_account>' and needs_attention(row)]
+    print("Users needing attention: {}".format(len(flagged_users)))
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        pending_emails = [e for emails in executor.map(check_user, flagged_users) for e in emails]
+
+    # Reminders are sent from the main thread once all checks finish, keeping SMTP out of the workers
+    for user_name, subject, body, when in pending_emails:
+        send_email("MAILBOX_EMAIL", "MAILBOX_PASSWORD", "recipient_email", subject, body)
+        print ("Email sent to " + user_name + " warning of key rotation " + when + ".")
+except (ClientError, RuntimeError) as e:
+    print("Failed to check access keys: {}".format(e))
@@ -4,13 +4,20 @@ AWS RDS Management Lambda Function
 This module provides functionality to automatically start and stop RDS instances
 based on configurable tags, time of day, and day of the week. It is designed to
 run as an AWS Lambda function for cost optimization.
+
+Required IAM permissions: tag:GetResources (tagged instances are looked up through
+the Resource Groups Tagging API), rds:StartDBInstance and rds:StopDBInstance.
+rds:DescribeDBInstances and rds:ListTagsForResource are no longer used.
 """
 
 import boto3
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 from dateutil import tz
 import logging
 import os
+import threading
+import time
 
 # Configure logging to display informational messages
 logging.basicConfig(level=logging.INFO)
@@ -21,6 +28,9 @@ region = os.getenv("AWS_REGION", "us-east-1")
 # Create AWS RDS client using the specified region
 rds = boto3.client('rds', region_name=region)
 
+# Resource Groups Tagging API client, used to look up RDS instances by tag
+rgt = boto3.client('resourcegroupstaggingapi', region_name=region)
+
 # Define required tags for RDS instances to be managed
 # Tags are configurable via environment variables TAG_KEY and TAG_VALUE
 REQUIRED_TAGS = {
@@ -29,24 +39,45 @@ REQUIRED_TAGS = {
 
 # Set timezone from environment variable, default to UTC
 TIMEZONE = tz.gettz(os.getenv("TIMEZONE", "UTC"))
+
+# Maximum number of concurrent start/stop API calls
+MAX_WORKERS = 20
+
+# Seconds to reuse the tagged instance list across warm invocations, configurable via TAG_CACHE_TTL
+TAG_CACHE_TTL = int(os.getenv("TAG_CACHE_TTL", "600"))
+_tag_cache = {"ts": 0, "instances": []}
+_tag_cache_lock = threading.Lock()
 def get_tagged_rds_instances():
-    """Fetches RDS instances with required tags."""
+    """Fetches RDS instances with required tags, cached for TAG_CACHE_TTL seconds."""
+    with _tag_cache_lock:
+        if time.time() - _tag_cache["ts"] < TAG_CACHE_TTL:
+            return list(_tag_cache["instances"])
+        try:
+            # Let the tagging API match the required tags server-side instead of
+            # listing every instance and fetching its tags one call at a time
+            paginator = rgt.get_paginator('get_resources')
+            tag_filters = [{'Key': key, 'Values': [value]} for key, value in REQUIRED_TAGS.items()]
+            tagged_instances = []
+            for page in paginator.paginate(TagFilters=tag_filters, ResourceTypeFilters=['rds:db']):
+                for resource in page['ResourceTagMappingList']:
+                    # ARN format: arn:aws:rds:<region>:<account>:db:<DBInstanceIdentifier>
+                    tagged_instances.append(resource['ResourceARN'].split(':')[-1])
+            # Only successful lookups are cached, so a failure is retried on the next invocation
+            _tag_cache["instances"] = tagged_instances
+            _tag_cache["ts"] = time.time()
+            return list(tagged_instances)
+        except Exception as e:
+            logging.error(f"Error fetching RDS instances: {str(e)}")
+            return []
+def change_rds_state(action, db_identifier):
+    """Starts or stops one RDS instance, logging failures instead of raising."""
     try:
-        # Retrieve all DB instances from AWS RDS
-        instances = rds.describe_db_instances()['DBInstances']
-        tagged_instances = []
-        for db in instances:
-            # Get tags for the current DB instance
-            tags = rds.list_tags_for_resource(ResourceName=db['DBInstanceArn'])['TagList']
-            # Convert tag list to dictionary for easy lookup
-            tag_dict = {tag['Key']: tag['Value'] for tag in tags}
-            # Check if all required tags match the instance's tags
-            if all(REQUIRED_TAGS[key] == tag_dict.get(key, "") for key in REQUIRED_TAGS):
-                tagged_instances.append(db['DBInstanceIdentifier'])
-        return tagged_instances
+        if action == "start":
+            rds.start_db_instance(DBInstanceIdentifier=db_identifier)
+        else:
+            rds.stop_db_instance(DBInstanceIdentifier=db_identifier)
     except Exception as e:
-        logging.error(f"Error fetching RDS instances: {str(e)}")
-        return []
+        logging.error(f"Error trying to {action} RDS {db_identifier}: {str(e)}")
 def lambda_handler(event, context):
     """Lambda function to start/stop RDS based on time and day."""
     # Get current time in the configured timezone
@@ -55,15 +86,20 @@ def lambda_handler(event, context):
     current_day = now.weekday()
     # Retrieve list of RDS instances that have the required tags
     tagged_rds_instances = get_tagged_rds_instances()
+    tasks = []
     for db_identifier in tagged_rds_instances:
         if 0 <= current_day <= 4:  # Weekdays (Monday-Friday)
             if 6 <= current_hour < 18:  # Business hours (6 AM to 6 PM)
                 logging.info(f"Starting RDS {db_identifier}...")
-                rds.start_db_instance(DBInstanceIdentifier=db_identifier)
+                tasks.append(("start", db_identifier))
             else:  # Outside business hours
                 logging.info(f"Stopping RDS {db_identifier}...")
-                rds.stop_db_instance(DBInstanceIdentifier=db_identifier)
+                tasks.append(("stop", db_identifier))
         else:  # Weekends (Saturday-Sunday)
             logging.info(f"Stopping RDS {db_identifier} for the weekend...")
-            rds.stop_db_instance(DBInstanceIdentifier=db_identifier)
+            tasks.append(("stop", db_identifier))
+    # Issue the start/stop calls concurrently; each one is a blocking API round trip
+    if tasks:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            list(executor.map(lambda task: change_rds_state(*task), tasks))
     return "Lambda execution completed."